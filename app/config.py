@@ -1,31 +1,45 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
-# Load .env file only if it exists (for local development)
-# Render provides environment variables directly
-if os.path.exists('.env'):
+# Load .env file if it exists, unless the real environment is explicitly
+# production (Render sets ENVIRONMENT=production and provides variables directly).
+# ENVIRONMENT is read before .env, so local setups need not set it at all.
+if os.getenv("ENVIRONMENT") != "production" and os.path.exists('.env'):
     load_dotenv()
 
 class Settings:
-    # OpenAI Configuration
-    openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
-    model_name: str = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
-    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
-    max_tokens: int = int(os.getenv("MAX_TOKENS", "500"))
-    temperature: float = float(os.getenv("TEMPERATURE", "0.7"))
-    
-    # Pinecone Configuration
-    pinecone_api_key: str = os.getenv("PINECONE_API_KEY", "")
-    pinecone_environment: str = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
-    pinecone_index_name: str = os.getenv("PINECONE_INDEX_NAME", "christian-apologetics")
-    
-    # RAG Configuration
-    top_k: int = int(os.getenv("TOP_K", "5"))
-    chunk_size: int = int(os.getenv("CHUNK_SIZE", "1000"))
-    chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "200"))
-    
-    # Server Configuration
-    port: int = int(os.getenv("PORT", "8000"))
-    environment: str = os.getenv("ENVIRONMENT", "production")
+    def __init__(self):
+        # OpenAI Configuration
+        self.openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+        self.model_name: str = os.getenv("MODEL_NAME", "gpt-3.5-turbo")
+        self.embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+        self.max_tokens: int = int(os.getenv("MAX_TOKENS", "500"))
+        self.temperature: float = float(os.getenv("TEMPERATURE", "0.7"))
+        
+        # Pinecone Configuration
+        self.pinecone_api_key: str = os.getenv("PINECONE_API_KEY", "")
+        self.pinecone_environment: str = os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
+        self.pinecone_index_name: str = os.getenv("PINECONE_INDEX_NAME", "christian-apologetics")
+        
+        # RAG Configuration
+        self.top_k: int = int(os.getenv("TOP_K", "5"))
+        self.chunk_size: int = int(os.getenv("CHUNK_SIZE", "1000"))
+        self.chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "200"))
+        
+        # Server Configuration
+        self.port: int = int(os.getenv("PORT", "8000"))
+        self.environment: str = os.getenv("ENVIRONMENT", "production")
 
-settings = Settings() 
\ No newline at end of file
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Read the environment once; call get_settings.cache_clear() to re-read it"""
+    return Settings()
+
+
+def __getattr__(name: str):
+    # Backwards-compatible lazy alias for `from app.config import settings`
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,18 +1,44 @@
+import asyncio
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.routes.chat import router as chat_router
 from app.models.user_usage import create_tables
+from app.services.deps import get_pinecone_service, get_rate_limiting_service
 
 app = FastAPI(
     title="Christian Apologetics RAG Chatbot",
     description="A RAG chatbot for Christian apologetics using OpenAI and Pinecone",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Create database tables on startup
 create_tables()
 
+@app.on_event("startup")
+async def warm_up_services():
+    """Connect to Pinecone before the first request instead of during it"""
+    try:
+        await asyncio.to_thread(get_pinecone_service()._initialize_pinecone)
+    except Exception as e:
+        # Retrieval retries the connection lazily if this fails
+        print(f"Warning: Pinecone warm-up failed: {str(e)}")
+
+@app.on_event("startup")
+async def start_usage_flusher():
+    """Periodically write cached rate-limit counters back to the database"""
+    app.state.usage_flusher = asyncio.create_task(get_rate_limiting_service().run_flusher())
+
+@app.on_event("shutdown")
+async def stop_usage_flusher():
+    app.state.usage_flusher.cancel()
+    try:
+        await asyncio.to_thread(get_rate_limiting_service().flush)
+    except Exception as e:
+        print(f"Warning: failed to flush usage counters on shutdown: {str(e)}")
+
 # CORS middleware - more restrictive for production
 # You can customize allowed_origins based on your frontend domain
 allowed_origins = [
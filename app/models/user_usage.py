@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timedelta
@@ -9,8 +10,9 @@ Base = declarative_base()
 class UserUsage(Base):
     __tablename__ = "user_usage"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(String, index=True, nullable=False)
+    # The 16-hex-char user hash is the natural key: lookups are primary-key
+    # gets and it is the conflict target for the rate limiter's upsert
+    user_id = Column(String(16), primary_key=True)
     date = Column(DateTime, default=datetime.utcnow)
     daily_message_count = Column(Integer, default=0)
     monthly_message_count = Column(Integer, default=0)
@@ -21,12 +23,65 @@ class UserUsage(Base):
 
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chatbot_usage.db")
-engine = create_engine(DATABASE_URL)
+_is_sqlite = DATABASE_URL.startswith("sqlite")
+_is_sqlite_memory = _is_sqlite and make_url(DATABASE_URL).database in (None, "", ":memory:")
+
+# Size the QueuePool; in-memory SQLite uses SingletonThreadPool, which takes no sizing
+_pool_options = {} if _is_sqlite_memory else {"pool_size": 20, "max_overflow": 10}
+engine = create_engine(
+    DATABASE_URL,
+    **_pool_options,
+    # FastAPI runs sync dependencies in a thread pool, so connections move between threads
+    connect_args={"check_same_thread": False} if _is_sqlite else {}
+)
+
+if _is_sqlite:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Use WAL so readers don't block behind the single writer"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Indexes no longer in the model; every lookup is by user_id, so they only slow writes
+RETIRED_INDEXES = ("ix_user_usage_user_date",)
+
+# Tables created before user_id became the primary key keep a surrogate id key;
+# on those this unique index is the conflict target for the rate limiter's upsert
+LEGACY_USER_ID_INDEX = "ux_user_usage_user_id"
+
 def create_tables():
-    """Create database tables if they don't exist"""
+    """Create database tables (and any indexes added since) if they don't exist"""
     Base.metadata.create_all(bind=engine)
+    # create_all skips indexes on tables that already exist
+    for index in UserUsage.__table__.indexes:
+        try:
+            index.create(bind=engine, checkfirst=True)
+        except Exception as e:
+            print(f"Warning: could not create index {index.name}: {str(e)}")
+    
+    retired = list(RETIRED_INDEXES)
+    if inspect(engine).get_pk_constraint("user_usage")["constrained_columns"] == ["user_id"]:
+        # The primary key already makes user_id unique
+        retired.append(LEGACY_USER_ID_INDEX)
+    else:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {LEGACY_USER_ID_INDEX} ON user_usage (user_id)"
+                ))
+        except Exception as e:
+            print(f"Warning: could not create index {LEGACY_USER_ID_INDEX}: {str(e)}")
+    
+    for name in retired:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        except Exception as e:
+            print(f"Warning: could not drop index {name}: {str(e)}")
 
 def get_db():
     """Get database session"""
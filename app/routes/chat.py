@@ -2,31 +2,39 @@
 
 - Request limits: 25 messages/day and 750 messages/month per user (by IP).
 - Answer length is enforced in `openai_service.py` (~300 words).
+- `/chat/stream` streams the answer as server-sent events, cut at the same
+  word limit; `/chat` (and the shared answer cache) also end it on a
+  sentence boundary.
 """
 
+import json
+import time
+from collections import OrderedDict
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime
 from app.services.openai_service import OpenAIService
 from app.services.pinecone_service import PineconeService
 from app.services.rate_limiting_service import RateLimitingService
-from app.models.user_usage import get_db
+from app.services.deps import get_openai_service, get_pinecone_service, get_rate_limiting_service
+from app.models.user_usage import SessionLocal, get_db
 from sqlalchemy.orm import Session
 
 
 router = APIRouter()
 
-# Initialize services
-openai_service = OpenAIService()
-pinecone_service = PineconeService()
-rate_limiting_service = RateLimitingService()
+# Answers to recently asked stand-alone questions (no conversation history)
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 3600.0  # seconds
+_response_cache: "OrderedDict[str, Tuple[float, str, List[dict]]]" = OrderedDict()
 
 
 def _get_user_key(req: Request) -> str:
     """Use client IP (or X-Forwarded-For) as a lightweight user key."""
-    ip = req.headers.get("x-forwarded-for") or req.client.host or "unknown"
-    return ip.split(",")[0].strip()
+    # Only the first hop matters; maxsplit avoids scanning long proxy chains
+    return req.headers.get("x-forwarded-for", "").split(",", 1)[0].strip() or req.client.host or "unknown"
 
 
 class ChatRequest(BaseModel):
@@ -40,68 +48,194 @@ class ChatResponse(BaseModel):
     question: str
 
 
+async def _prepare_chat(
+    request: ChatRequest,
+    openai_service: OpenAIService,
+    pinecone_service: PineconeService,
+) -> Tuple[List[Dict[str, str]], str, List[dict]]:
+    """Retrieve context for the question and build the conversation messages and sources."""
+    # Generate embedding for the question
+    question_embedding = await openai_service.get_embeddings([request.question])
+
+    # Retrieve relevant documents; tolerate transient vector store errors
+    try:
+        relevant_docs = await pinecone_service.search_similar(question_embedding[0])
+    except Exception:
+        relevant_docs = []
+
+    # Build context and sources
+    context = ""
+    sources: List[dict] = []
+    if relevant_docs:
+        parts: List[str] = []
+        for doc in relevant_docs:
+            parts.append(doc["text"])
+            sources.append({
+                "text": doc["text"][:200] + "..." if len(doc["text"]) > 200 else doc["text"],
+                "source": doc["source"],
+                "score": doc["score"],
+            })
+        context = "\n\n".join(parts)
+    else:
+        context = (
+            "This is a Christian apologetics chatbot. You can ask questions "
+            "about Christian faith, apologetics, and biblical topics."
+        )
+
+    # Conversation messages
+    messages: List[Dict[str, str]] = []
+    if request.conversation_history:
+        messages.extend(request.conversation_history)
+    messages.append({"role": "user", "content": request.question})
+
+    return messages, context, sources
+
+
+def _response_cache_key(request: ChatRequest) -> Optional[str]:
+    """Normalized question, or None when the answer depends on prior conversation."""
+    if request.conversation_history:
+        return None
+    return " ".join(request.question.lower().split())
+
+
+def _get_cached_response(key: Optional[str]) -> Optional[Tuple[str, List[dict]]]:
+    if key is None:
+        return None
+    cached = _response_cache.get(key)
+    if cached is None:
+        return None
+    stored_at, answer, sources = cached
+    if time.monotonic() - stored_at >= RESPONSE_CACHE_TTL:
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return answer, sources
+
+
+def _store_cached_response(key: Optional[str], answer: str, sources: List[dict]) -> None:
+    if key is None:
+        return
+    _response_cache[key] = (time.monotonic(), answer, sources)
+    if len(_response_cache) > RESPONSE_CACHE_SIZE:
+        _response_cache.popitem(last=False)
+
+
+def _log_chat_error(e: Exception) -> None:
+    import traceback
+    error_details = traceback.format_exc()
+    print(f"❌ CHAT ERROR: {str(e)}")
+    print(f"❌ FULL TRACEBACK: {error_details}")
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(req: Request, request: ChatRequest, db: Session = Depends(get_db)):
+async def chat(
+    req: Request,
+    request: ChatRequest,
+    db: Session = Depends(get_db),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    pinecone_service: PineconeService = Depends(get_pinecone_service),
+    rate_limiting_service: RateLimitingService = Depends(get_rate_limiting_service),
+):
     """Chat endpoint implementing RAG with per-user daily/monthly limits."""
-    try:
-        user_key = _get_user_key(req)
-        
-        # Check rate limits using database system
-        is_allowed, message, usage_info = rate_limiting_service.check_rate_limit(user_key, db)
-        if not is_allowed:
-            raise HTTPException(status_code=429, detail=message)
+    user_key = _get_user_key(req)
 
-        # Generate embedding for the question
-        question_embedding = await openai_service.get_embeddings([request.question])
+    # Check rate limits and count this message in a single DB transaction
+    is_allowed, message, usage_info = rate_limiting_service.check_and_increment(user_key, db)
+    if not is_allowed:
+        raise HTTPException(status_code=429, detail=message)
 
-        # Retrieve relevant documents; tolerate transient vector store errors
-        try:
-            relevant_docs = await pinecone_service.search_similar(question_embedding[0])
-        except Exception:
-            relevant_docs = []
-
-        # Build context and sources
-        context = ""
-        sources: List[dict] = []
-        if relevant_docs:
-            parts: List[str] = []
-            for doc in relevant_docs:
-                parts.append(doc["text"])
-                sources.append({
-                    "text": doc["text"][:200] + "..." if len(doc["text"]) > 200 else doc["text"],
-                    "source": doc["source"],
-                    "score": doc["score"],
-                })
-            context = "\n\n".join(parts)
-        else:
-            context = (
-                "This is a Christian apologetics chatbot. You can ask questions "
-                "about Christian faith, apologetics, and biblical topics."
-            )
-
-        # Conversation messages
-        messages: List[Dict[str, str]] = []
-        if request.conversation_history:
-            messages.extend(request.conversation_history)
-        messages.append({"role": "user", "content": request.question})
+    # Re-asked questions skip retrieval and generation entirely
+    cache_key = _response_cache_key(request)
+    cached = _get_cached_response(cache_key)
+    if cached is not None:
+        answer, sources = cached
+        return ChatResponse(answer=answer, sources=sources, question=request.question)
+
+    try:
+        messages, context, sources = await _prepare_chat(request, openai_service, pinecone_service)
 
         # Generate answer (~300 words enforced in service)
         answer = await openai_service.get_chat_completion(messages, context)
-
-        # Increment usage counters after successful response
-        rate_limiting_service.increment_usage(user_key, db)
+        _store_cached_response(cache_key, answer, sources)
 
         return ChatResponse(answer=answer, sources=sources, question=request.question)
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"❌ CHAT ERROR: {str(e)}")
-        print(f"❌ FULL TRACEBACK: {error_details}")
+        # Only successful responses count towards the limits
+        rate_limiting_service.refund_usage(user_key, db)
+        _log_chat_error(e)
         raise HTTPException(status_code=500, detail=f"Error processing chat request: {str(e)}")
 
 
+@router.post("/chat/stream")
+async def chat_stream(
+    req: Request,
+    request: ChatRequest,
+    db: Session = Depends(get_db),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    pinecone_service: PineconeService = Depends(get_pinecone_service),
+    rate_limiting_service: RateLimitingService = Depends(get_rate_limiting_service),
+):
+    """Streaming variant of /chat using server-sent events.
+
+    Emits a `sources` event first, then `token` events as the answer is
+    generated, and finally `done` (or `error` if generation fails midway).
+    """
+    user_key = _get_user_key(req)
+
+    is_allowed, message, usage_info = rate_limiting_service.check_and_increment(user_key, db)
+    if not is_allowed:
+        raise HTTPException(status_code=429, detail=message)
+
+    cache_key = _response_cache_key(request)
+    cached = _get_cached_response(cache_key)
+    if cached is not None:
+        answer, sources = cached
+
+        async def cached_stream():
+            yield _sse({"type": "sources", "sources": sources, "question": request.question})
+            yield _sse({"type": "token", "content": answer})
+            yield _sse({"type": "done"})
+
+        return StreamingResponse(cached_stream(), media_type="text/event-stream")
+
+    try:
+        messages, context, sources = await _prepare_chat(request, openai_service, pinecone_service)
+    except Exception as e:
+        rate_limiting_service.refund_usage(user_key, db)
+        _log_chat_error(e)
+        raise HTTPException(status_code=500, detail=f"Error processing chat request: {str(e)}")
+
+    async def event_stream():
+        yield _sse({"type": "sources", "sources": sources, "question": request.question})
+        parts: List[str] = []
+        try:
+            async for delta in openai_service.get_chat_completion_stream(messages, context):
+                parts.append(delta)
+                yield _sse({"type": "token", "content": delta})
+        except Exception as e:
+            # The request-scoped session is already closed once streaming starts
+            with SessionLocal() as refund_db:
+                rate_limiting_service.refund_usage(user_key, refund_db)
+            _log_chat_error(e)
+            yield _sse({"type": "error", "detail": f"Error processing chat request: {str(e)}"})
+            return
+        # /chat reads the same cache, so store the answer it would have given
+        _store_cached_response(cache_key, openai_service.finalize_streamed_answer("".join(parts)), sources)
+        yield _sse({"type": "done"})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.get("/usage")
-async def get_usage(req: Request, db: Session = Depends(get_db)):
+async def get_usage(
+    req: Request,
+    db: Session = Depends(get_db),
+    rate_limiting_service: RateLimitingService = Depends(get_rate_limiting_service),
+):
     """Return current user's usage counters and configured limits."""
     user_key = _get_user_key(req)
     usage_stats = rate_limiting_service.get_usage_stats(user_key, db)
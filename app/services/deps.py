@@ -0,0 +1,21 @@
+"""Process-wide service instances, shared through FastAPI dependencies."""
+
+from functools import lru_cache
+from app.services.openai_service import OpenAIService
+from app.services.pinecone_service import PineconeService
+from app.services.rate_limiting_service import RateLimitingService
+
+
+@lru_cache(maxsize=1)
+def get_openai_service() -> OpenAIService:
+    return OpenAIService()
+
+
+@lru_cache(maxsize=1)
+def get_pinecone_service() -> PineconeService:
+    return PineconeService()
+
+
+@lru_cache(maxsize=1)
+def get_rate_limiting_service() -> RateLimitingService:
+    return RateLimitingService()
@@ -1,6 +1,10 @@
 import openai
-from typing import List, Dict, Any
-from app.config import settings
+import re
+from array import array
+from collections import OrderedDict
+from openai import AsyncOpenAI
+from typing import List, Dict, Any, AsyncIterator, Iterable, Iterator, Tuple
+from app.config import get_settings
 try:
     # Optional profile support. If the profile loader is missing (e.g.,
     # after a revert), we fall back to a built-in default profile.
@@ -8,69 +12,48 @@ try:
 except Exception:  # pragma: no cover
     load_profile = None  # Fallback handled below
 
+# Number of (model, text) -> embedding entries kept in memory. Vectors are
+# stored as packed doubles (~12 KB each for 1536 dims) to keep this bounded.
+EMBEDDING_CACHE_SIZE = 4096
+
+_WORD_RE = re.compile(r"\S+")
+
 class OpenAIService:
     def __init__(self):
+        settings = get_settings()
         self.openai_api_key = settings.openai_api_key
         self.model_name = settings.model_name
         self.embedding_model = settings.embedding_model
         self.max_tokens = settings.max_tokens
         self.temperature = settings.temperature
+        # Reuse one client per timeout profile so the underlying httpx
+        # connection pool (and TLS sessions) survive across requests. The
+        # async clients keep network waits off the event loop.
+        self._client_embed = AsyncOpenAI(
+            api_key=self.openai_api_key,
+            timeout=30.0,
+            max_retries=2
+        )
+        self._client_chat = AsyncOpenAI(
+            api_key=self.openai_api_key,
+            timeout=60.0,
+            max_retries=2
+        )
+        self._embedding_cache: "OrderedDict[Tuple[str, str], array]" = OrderedDict()
+        # The profile is static, so the prompt only needs the context appended per request
+        self._system_prefix = self._build_system_prefix()
     
-    def _truncate_to_word_limit(self, text: str, max_words: int = 300) -> str:
-        """Truncate a text to a maximum number of words without cutting mid-sentence when possible."""
-        if not text:
-            return text
-        words = text.split()
-        if len(words) <= max_words:
-            return text
-        truncated = " ".join(words[:max_words])
-        # Try to end on a sentence boundary
-        last_period = truncated.rfind(".")
-        if last_period >= int(max_words * 0.6):
-            return truncated[: last_period + 1]
-        return truncated
-    
-    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for a list of texts"""
-        try:
-            from openai import OpenAI
-            # Explicitly create client with only supported parameters
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                timeout=30.0,
-                max_retries=2
-            )
-            response = client.embeddings.create(
-                model=self.embedding_model,
-                input=texts
-            )
-            return [embedding.embedding for embedding in response.data]
-        except Exception as e:
-            raise Exception(f"Error generating embeddings: {str(e)}")
-    
-    async def get_chat_completion(self, messages: List[Dict[str, str]], context: str = "") -> str:
-        """Generate a chat completion with optional context"""
-        try:
-            from openai import OpenAI
-            # Explicitly create client with only supported parameters
-            client = OpenAI(
-                api_key=self.openai_api_key,
-                timeout=60.0,
-                max_retries=2
-            )
-            
-            # Create system message with context
-            if load_profile is not None:
-                try:
-                    profile = load_profile()
-                except Exception:
-                    profile = {}
-            else:
+    def _build_system_prefix(self) -> str:
+        """Build the static part of the system prompt (everything before the context)"""
+        if load_profile is not None:
+            try:
+                profile = load_profile()
+            except Exception:
                 profile = {}
+        else:
+            profile = {}
 
-            system_message = {
-                "role": "system",
-                "content": f"""You are {profile.get('identity', 'a Christian apologetics assistant')}.
+        return f"""You are {profile.get('identity', 'a Christian apologetics assistant')}.
 
 IMPORTANT: You are a CHRISTIAN chatbot. Always give CHRISTIAN answers first using the Bible as your primary authority.
 
@@ -104,45 +87,178 @@ Length policy: at most {profile.get('length_policy', {}).get('max_words', 300)}
 Citations: Bible format {profile.get('citations', {}).get('bible', {}).get('format', 'Book Chapter:Verse')}; Qur'an format {profile.get('citations', {}).get('quran', {}).get('format', 'Surah:Ayah')}.
 
 Context (use faithfully, but do not fabricate):
-{context}
 """
-            }
-            
+    
+    def _truncate_to_word_limit(self, text: str, max_words: int = 300) -> str:
+        """Truncate a text to a maximum number of words without cutting mid-sentence when possible."""
+        if not text:
+            return text
+        # Find where word max_words + 1 starts without building a word list;
+        # the common under-limit case returns the original string untouched
+        for count, match in enumerate(_WORD_RE.finditer(text), 1):
+            if count > max_words:
+                break
+        else:
+            return text
+        return self._end_on_sentence(text[: match.start()].rstrip(), max_words)
+    
+    def _end_on_sentence(self, truncated: str, max_words: int) -> str:
+        """Try to end a truncated answer on a sentence boundary"""
+        last_period = truncated.rfind(".")
+        if last_period >= int(max_words * 0.6):
+            return truncated[: last_period + 1]
+        return truncated
+    
+    def finalize_streamed_answer(self, text: str, max_words: int = 300) -> str:
+        """Turn the deltas of get_chat_completion_stream, joined, into the answer get_chat_completion would return"""
+        # The stream stops right before word max_words + 1, so an answer that
+        # reached the limit was cut and still needs the sentence-boundary rule
+        for count, _ in enumerate(_WORD_RE.finditer(text), 1):
+            if count >= max_words:
+                return self._end_on_sentence(text.rstrip(), max_words)
+        return text
+    
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of texts, reusing cached vectors for repeated texts"""
+        try:
+            cache = self._embedding_cache
+            model = self.embedding_model
+            results: List[Any] = [None] * len(texts)
+            misses: Dict[str, List[int]] = {}
+            for i, text in enumerate(texts):
+                cached = cache.get((model, text))
+                if cached is not None:
+                    cache.move_to_end((model, text))
+                    results[i] = cached.tolist()
+                else:
+                    misses.setdefault(text, []).append(i)
+
+            if misses:
+                # Only the unique misses go out, in a single request
+                miss_texts = list(misses)
+                response = await self._client_embed.embeddings.create(
+                    model=model,
+                    input=miss_texts
+                )
+                for text, item in zip(miss_texts, response.data):
+                    for i in misses[text]:
+                        results[i] = item.embedding
+                    cache[(model, text)] = array("d", item.embedding)
+                    if len(cache) > EMBEDDING_CACHE_SIZE:
+                        cache.popitem(last=False)
+
+            return results
+        except Exception as e:
+            raise Exception(f"Error generating embeddings: {str(e)}")
+    
+    def _build_chat_request(self, messages: List[Dict[str, str]], context: str) -> Dict[str, Any]:
+        """Assemble the chat completion arguments shared by the blocking and streaming calls"""
+        # Create system message with context
+        system_message = {
+            "role": "system",
+            "content": self._system_prefix + context + "\n"
+        }
+        
+        # Ensure we always allow enough budget for a ~300-word answer
+        # by clamping to a safe minimum if an env var is set too low.
+        max_tokens_to_use = max(int(self.max_tokens), 480)
+        
+        return {
+            "model": self.model_name,
             # Combine system message with user messages
-            full_messages = [system_message] + messages
-            
-            # Ensure we always allow enough budget for a ~300-word answer
-            # by clamping to a safe minimum if an env var is set too low.
-            max_tokens_to_use = max(int(self.max_tokens), 480)
-
-            response = client.chat.completions.create(
-                model=self.model_name,
-                messages=full_messages,
-                max_tokens=max_tokens_to_use,
-                temperature=self.temperature
+            "messages": [system_message] + messages,
+            "max_tokens": max_tokens_to_use,
+            "temperature": self.temperature
+        }
+    
+    async def get_chat_completion(self, messages: List[Dict[str, str]], context: str = "") -> str:
+        """Generate a chat completion with optional context"""
+        try:
+            response = await self._client_chat.chat.completions.create(
+                **self._build_chat_request(messages, context)
             )
             content = response.choices[0].message.content
             return self._truncate_to_word_limit(content, max_words=300)
         except Exception as e:
             raise Exception(f"Error generating chat completion: {str(e)}")
     
+    async def get_chat_completion_stream(self, messages: List[Dict[str, str]], context: str = "", max_words: int = 300) -> AsyncIterator[str]:
+        """Stream a chat completion as text deltas, stopping once max_words words have been sent"""
+        try:
+            stream = await self._client_chat.chat.completions.create(
+                **self._build_chat_request(messages, context),
+                stream=True
+            )
+            try:
+                words = 0
+                in_word = False
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    # Running word count; cut the delta where word max_words + 1 would start
+                    for i, ch in enumerate(delta):
+                        if ch.isspace():
+                            in_word = False
+                        elif not in_word:
+                            in_word = True
+                            words += 1
+                            if words > max_words:
+                                tail = delta[:i].rstrip()
+                                if tail:
+                                    yield tail
+                                return
+                    yield delta
+            finally:
+                await stream.close()
+        except Exception as e:
+            raise Exception(f"Error generating chat completion: {str(e)}")
+    
+    def chunk_text_iter(self, text: str, chunk_size: int = None, overlap: int = None) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) offsets of overlapping chunks without materializing them"""
+        if chunk_size is None:
+            chunk_size = get_settings().chunk_size
+        if overlap is None:
+            overlap = get_settings().chunk_overlap
+        
+        step = chunk_size - overlap
+        if step <= 0:
+            raise ValueError("chunk_size must be greater than overlap")
+        
+        text_len = len(text)
+        for start in range(0, text_len, step):
+            yield start, min(start + chunk_size, text_len)
+    
     def chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
         """Split text into overlapping chunks"""
+        return [text[start:end] for start, end in self.chunk_text_iter(text, chunk_size, overlap)]
+    
+    def chunk_text_stream(self, blocks: Iterable[str], chunk_size: int = None, overlap: int = None) -> Iterator[str]:
+        """Split a stream of text blocks into the same chunks chunk_text would produce.
+
+        Only the unconsumed tail of the stream is buffered, so a large file
+        never has to be held in memory as one string.
+        """
         if chunk_size is None:
-            chunk_size = settings.chunk_size
+            chunk_size = get_settings().chunk_size
         if overlap is None:
-            overlap = settings.chunk_overlap
+            overlap = get_settings().chunk_overlap
         
-        chunks = []
-        start = 0
+        step = chunk_size - overlap
+        if step <= 0:
+            raise ValueError("chunk_size must be greater than overlap")
         
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - overlap
-            
-            if start >= len(text):
-                break
+        buffer = ""
+        for block in blocks:
+            buffer += block
+            start = 0
+            while len(buffer) - start >= chunk_size:
+                yield buffer[start:start + chunk_size]
+                start += step
+            buffer = buffer[start:]
         
-        return chunks 
\ No newline at end of file
+        # End of stream: the remaining starts get truncated chunks
+        for start in range(0, len(buffer), step):
+            yield buffer[start:start + chunk_size]
@@ -1,18 +1,107 @@
+import asyncio
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pinecone import Pinecone
-from typing import List, Dict, Any, Optional
-from app.config import settings
+from typing import List, Dict, Any, Optional, Tuple
+from app.config import get_settings
+
+# Client-side cache of recent query results, keyed by the query vector
+QUERY_CACHE_SIZE = 512
+QUERY_CACHE_TTL = 300.0  # seconds
+
+# Bulk uploads: vectors per upsert request, requests in flight, and attempts per request
+UPSERT_BATCH_SIZE = 100
+UPSERT_CONCURRENCY = 8
+UPSERT_RETRIES = 3
+
+
+def quantize_int8(values: List[float]) -> List[float]:
+    """Scale a vector onto the int8 grid [-127, 127].
+
+    The index uses cosine similarity, which ignores the per-vector scale, so
+    the rounded values can be sent as-is: they serialize to a few characters
+    each instead of ~20, with negligible effect on ranking.
+    """
+    peak = max((abs(v) for v in values), default=0.0)
+    if peak == 0.0:
+        return [0.0] * len(values)
+    factor = 127.0 / peak
+    return [float(round(v * factor)) for v in values]
+
+
+@dataclass
+class BatchChunks:
+    """Column-oriented batch of chunks ready for upsert.
+
+    Embeddings are quantized with quantize_int8 as they are added and live in
+    one flat int8 array (row-major, ``dim`` values per chunk), a byte per
+    dimension instead of a boxed Python float.
+    """
+    ids: List[str] = field(default_factory=list)
+    texts: List[str] = field(default_factory=list)
+    embeddings: array = field(default_factory=lambda: array("b"))
+    metadatas: List[Dict[str, Any]] = field(default_factory=list)
+    dim: int = 0
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def append(self, doc_id: str, text: str, embedding: List[float], metadata: Dict[str, Any]):
+        """Add one chunk to the batch"""
+        if not self.dim:
+            self.dim = len(embedding)
+        elif len(embedding) != self.dim:
+            raise ValueError(f"Embedding has {len(embedding)} dimensions, expected {self.dim}")
+        self.ids.append(doc_id)
+        self.texts.append(text)
+        self.embeddings.extend([int(v) for v in quantize_int8(embedding)])
+        self.metadatas.append(metadata)
+    
+    def embedding(self, i: int) -> array:
+        """Return the quantized embedding of chunk ``i``"""
+        return self.embeddings[i * self.dim:(i + 1) * self.dim]
+    
+    def slice(self, start: int, stop: int) -> "BatchChunks":
+        """Return chunks ``start:stop`` as a new batch"""
+        return BatchChunks(
+            ids=self.ids[start:stop],
+            texts=self.texts[start:stop],
+            embeddings=self.embeddings[start * self.dim:stop * self.dim],
+            metadatas=self.metadatas[start:stop],
+            dim=self.dim
+        )
 
 class PineconeService:
     def __init__(self):
+        settings = get_settings()
         self.api_key = settings.pinecone_api_key
         self.index_name = settings.pinecone_index_name
         self.pc = None
         self.index = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self._query_cache: "OrderedDict[Tuple[bytes, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+    
+    def _query_cache_key(self, query_embedding: List[float], top_k: int) -> Tuple[bytes, int]:
+        """Build a compact cache key from the query vector and top_k"""
+        digest = hashlib.blake2b(array("d", query_embedding).tobytes(), digest_size=16).digest()
+        return digest, top_k
     
     def _initialize_pinecone(self):
-        """Initialize Pinecone connection"""
-        if not self._initialized:
+        """Initialize Pinecone connection.
+
+        The app does this once at startup; the calls in the request methods
+        are a cheap no-op afterwards and only cover scripts and failed warm-ups.
+        """
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
             self.pc = Pinecone(api_key=self.api_key)
             # Fast path: try to attach to the index directly without an
             # expensive list-indexes call. If that fails (e.g., index not
@@ -44,37 +133,75 @@ class PineconeService:
         except Exception as e:
             raise Exception(f"Error initializing Pinecone: {str(e)}")
     
-    async def upsert_documents(self, documents: List[Dict[str, Any]]) -> bool:
-        """Upsert documents to Pinecone index"""
+    async def upsert_documents(self, batch: BatchChunks) -> bool:
+        """Upsert a batch of chunks to Pinecone index"""
         try:
             self._initialize_pinecone()
             vectors = []
-            for doc in documents:
+            for i, (doc_id, text, metadata) in enumerate(zip(batch.ids, batch.texts, batch.metadatas)):
                 vector = {
-                    "id": doc["id"],
-                    "values": doc["embedding"],
+                    "id": doc_id,
+                    # Already on the int8 grid; the client only accepts floats
+                    "values": [float(v) for v in batch.embedding(i)],
                     "metadata": {
-                        "text": doc["text"],
-                        "source": doc.get("source", "unknown"),
-                        "chunk_index": doc.get("chunk_index", 0)
+                        "text": text,
+                        "source": metadata.get("source", "unknown"),
+                        "chunk_index": metadata.get("chunk_index", 0)
                     }
                 }
                 vectors.append(vector)
             
-            self.index.upsert(vectors=vectors)
+            # The Pinecone client is blocking; keep it off the event loop
+            await asyncio.to_thread(self.index.upsert, vectors=vectors)
+            self._query_cache.clear()
             return True
         except Exception as e:
             raise Exception(f"Error upserting documents: {str(e)}")
     
+    async def upsert_batches(self, documents: BatchChunks, batch_size: int = UPSERT_BATCH_SIZE,
+                             concurrency: int = UPSERT_CONCURRENCY, retries: int = UPSERT_RETRIES) -> None:
+        """Upsert a large batch in chunks of batch_size, several at a time, retrying each chunk on its own"""
+        total_batches = (len(documents) + batch_size - 1) // batch_size
+        semaphore = asyncio.Semaphore(concurrency)
+        uploaded = 0
+        
+        async def upload(batch: BatchChunks):
+            nonlocal uploaded
+            async with semaphore:
+                for attempt in range(retries):
+                    try:
+                        await self.upsert_documents(batch)
+                        break
+                    except Exception:
+                        if attempt == retries - 1:
+                            raise
+                        await asyncio.sleep(2 ** attempt)
+            uploaded += 1
+            print(f"  Uploaded batch {uploaded}/{total_batches}")
+        
+        await asyncio.gather(*[
+            upload(documents.slice(i, i + batch_size)) for i in range(0, len(documents), batch_size)
+        ])
+    
     async def search_similar(self, query_embedding: List[float], top_k: int = None) -> List[Dict[str, Any]]:
         """Search for similar documents in Pinecone"""
         if top_k is None:
-            top_k = settings.top_k
+            top_k = get_settings().top_k
+        
+        cache_key = self._query_cache_key(query_embedding, top_k)
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            stored_at, documents = cached
+            if time.monotonic() - stored_at < QUERY_CACHE_TTL:
+                self._query_cache.move_to_end(cache_key)
+                return documents
+            del self._query_cache[cache_key]
         
         try:
             self._initialize_pinecone()
-            results = self.index.query(
-                vector=query_embedding,
+            results = await asyncio.to_thread(
+                self.index.query,
+                vector=quantize_int8(query_embedding),
                 top_k=top_k,
                 include_metadata=True
             )
@@ -88,6 +215,10 @@ class PineconeService:
                     "source": match.metadata.get("source", "unknown")
                 })
             
+            self._query_cache[cache_key] = (time.monotonic(), documents)
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+            
             return documents
         except Exception as e:
             raise Exception(f"Error searching Pinecone: {str(e)}")
@@ -95,7 +226,8 @@ class PineconeService:
     async def delete_documents(self, document_ids: List[str]) -> bool:
         """Delete documents from Pinecone index"""
         try:
-            self.index.delete(ids=document_ids)
+            await asyncio.to_thread(self.index.delete, ids=document_ids)
+            self._query_cache.clear()
             return True
         except Exception as e:
             raise Exception(f"Error deleting documents: {str(e)}")
@@ -103,7 +235,7 @@ class PineconeService:
     async def get_index_stats(self) -> Dict[str, Any]:
         """Get statistics about the Pinecone index"""
         try:
-            stats = self.index.describe_index_stats()
+            stats = await asyncio.to_thread(self.index.describe_index_stats)
             return {
                 "total_vector_count": stats.total_vector_count,
                 "dimension": stats.dimension,
@@ -1,126 +1,350 @@
+from sqlalchemy import bindparam, case, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from app.models.user_usage import UserUsage, get_db
+from app.models.user_usage import SessionLocal, UserUsage, get_db
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from typing import Dict, Optional, Set, Tuple
+import asyncio
 import hashlib
+import threading
+import time
+from functools import lru_cache
+
+# Counters of active users are served from memory and written back in batches
+USAGE_FLUSH_INTERVAL = 5.0  # seconds
+USAGE_CACHE_TTL = 600.0  # seconds without activity before an entry is dropped
+
+# The limiter reads and writes single rows, so it uses Core statements on the
+# table directly and skips the ORM's identity map and unit of work
+_usage_table = UserUsage.__table__
+_usage_columns = (
+    _usage_table.c.daily_message_count,
+    _usage_table.c.monthly_message_count,
+    _usage_table.c.last_reset_date,
+)
+
+
+@lru_cache(maxsize=10000)
+def _hash_user_identifier(user_identifier: str) -> str:
+    # Only a privacy pseudonym, so a 64-bit BLAKE2b digest (16 hex chars) is enough
+    return hashlib.blake2b(user_identifier.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class _UsageEntry:
+    """In-memory copy of a user's counters (same attribute names as UserUsage)"""
+    __slots__ = ("daily_message_count", "monthly_message_count", "last_reset_date", "last_access")
+    
+    def __init__(self, daily_message_count: int, monthly_message_count: int, last_reset_date: datetime):
+        self.daily_message_count = daily_message_count
+        self.monthly_message_count = monthly_message_count
+        self.last_reset_date = last_reset_date
+        self.last_access = time.monotonic()
+
 
 class RateLimitingService:
+    """
+    Per-user daily/monthly limits. The database row is loaded (and the first
+    message counted) atomically on a cache miss; after that the user's counters
+    live in memory and dirty entries are flushed every USAGE_FLUSH_INTERVAL
+    seconds by run_flusher(). Counters are authoritative per process, so the
+    app is expected to run a single worker.
+    """
     def __init__(self):
         self.daily_limit = 25
         self.monthly_limit = 750
+        self._cache: Dict[str, _UsageEntry] = {}
+        self._dirty: Set[str] = set()
+        # Guards _cache/_dirty against the flusher, which writes from a worker thread
+        self._lock = threading.Lock()
     
     def _get_user_hash(self, user_identifier: str) -> str:
-        """Create a hash of user identifier for privacy"""
-        return hashlib.sha256(user_identifier.encode()).hexdigest()[:16]
-    
-    def _get_or_create_user_usage(self, db: Session, user_id: str) -> UserUsage:
-        """Get or create user usage record"""
-        user_usage = db.query(UserUsage).filter(UserUsage.user_id == user_id).first()
-        
-        if not user_usage:
-            user_usage = UserUsage(
-                user_id=user_id,
-                daily_message_count=0,
-                monthly_message_count=0,
-                last_reset_date=datetime.utcnow()
-            )
-            db.add(user_usage)
-            db.commit()
-            db.refresh(user_usage)
+        """Create a hash of user identifier for privacy (memoized per identifier)"""
+        return _hash_user_identifier(user_identifier)
+    
+    def _get_or_create_user_usage(self, db: Session, user_id: str, now: Optional[datetime] = None) -> _UsageEntry:
+        """Get or create user usage record, returned as a detached copy of its counters"""
+        row = db.execute(select(*_usage_columns).where(_usage_table.c.user_id == user_id)).first()
+        if row is not None:
+            return _UsageEntry(*row)
         
-        return user_usage
+        last_reset = now or datetime.utcnow()
+        db.execute(insert(_usage_table).values(
+            user_id=user_id,
+            daily_message_count=0,
+            monthly_message_count=0,
+            last_reset_date=last_reset
+        ))
+        db.commit()
+        return _UsageEntry(0, 0, last_reset)
     
-    def _reset_daily_count_if_needed(self, user_usage: UserUsage) -> bool:
+    def _save_user_usage(self, db: Session, user_id: str, user_usage: _UsageEntry) -> None:
+        """Write a user's counters back to the row (caller commits)"""
+        db.execute(
+            update(_usage_table)
+            .where(_usage_table.c.user_id == user_id)
+            .values(
+                daily_message_count=user_usage.daily_message_count,
+                monthly_message_count=user_usage.monthly_message_count,
+                last_reset_date=user_usage.last_reset_date,
+            )
+        )
+    
+    def _reset_daily_count_if_needed(self, user_usage: _UsageEntry, now: datetime) -> bool:
         """Reset daily count if it's a new day"""
-        now = datetime.utcnow()
-        last_reset = user_usage.last_reset_date
-        
-        # Check if it's a new day
-        if last_reset.date() < now.date():
+        # Check if it's a new day (ordinals compare calendar days as ints)
+        if user_usage.last_reset_date.toordinal() < now.toordinal():
             user_usage.daily_message_count = 0
             user_usage.last_reset_date = now
             return True
         return False
     
-    def _reset_monthly_count_if_needed(self, user_usage: UserUsage) -> bool:
+    def _reset_monthly_count_if_needed(self, user_usage: _UsageEntry, now: datetime) -> bool:
         """Reset monthly count if it's a new month"""
-        now = datetime.utcnow()
         last_reset = user_usage.last_reset_date
         
         # Check if it's a new month
-        if (last_reset.year, last_reset.month) < (now.year, now.month):
+        if last_reset.year * 12 + last_reset.month < now.year * 12 + now.month:
             user_usage.monthly_message_count = 0
             return True
         return False
     
-    def check_rate_limit(self, user_identifier: str, db: Session) -> Tuple[bool, str, dict]:
+    def _reset_counts_if_needed(self, user_usage: _UsageEntry, now: Optional[datetime] = None) -> bool:
+        """Apply day/month rollover against a single clock reading"""
+        if now is None:
+            now = datetime.utcnow()
+        # Monthly first: the daily reset moves last_reset_date forward, which
+        # would otherwise hide the month change
+        monthly_reset = self._reset_monthly_count_if_needed(user_usage, now)
+        daily_reset = self._reset_daily_count_if_needed(user_usage, now)
+        return daily_reset or monthly_reset
+    
+    def _atomic_check_and_increment(self, db: Session, user_id: str) -> Optional[Tuple[int, int, datetime]]:
         """
-        Check if user has exceeded rate limits
-        Returns: (is_allowed, message, usage_info)
+        Reset stale counters, check the limits and count the message with a
+        single INSERT ... ON CONFLICT DO UPDATE ... RETURNING statement.
+        Returns the new (daily, monthly, last_reset) values, or None if a limit was hit.
         """
-        user_id = self._get_user_hash(user_identifier)
-        user_usage = self._get_or_create_user_usage(db, user_id)
-        
-        # Reset counts if needed
-        daily_reset = self._reset_daily_count_if_needed(user_usage)
-        monthly_reset = self._reset_monthly_count_if_needed(user_usage)
-        
-        if daily_reset or monthly_reset:
-            db.commit()
-            db.refresh(user_usage)
-        
-        # Check daily limit
-        if user_usage.daily_message_count >= self.daily_limit:
-            usage_info = {
-                "daily_used": user_usage.daily_message_count,
-                "daily_limit": self.daily_limit,
-                "monthly_used": user_usage.monthly_message_count,
-                "monthly_limit": self.monthly_limit
-            }
-            return False, f"Daily limit of {self.daily_limit} messages exceeded. Try again tomorrow.", usage_info
+        now = datetime.utcnow()
+        day_start = datetime(now.year, now.month, now.day)
+        month_start = datetime(now.year, now.month, 1)
+        
+        c = _usage_table.c
+        new_day = c.last_reset_date < day_start
+        daily = case((new_day, 0), else_=c.daily_message_count)
+        monthly = case((c.last_reset_date < month_start, 0), else_=c.monthly_message_count)
         
-        # Check monthly limit
-        if user_usage.monthly_message_count >= self.monthly_limit:
-            usage_info = {
-                "daily_used": user_usage.daily_message_count,
-                "daily_limit": self.daily_limit,
-                "monthly_used": user_usage.monthly_message_count,
-                "monthly_limit": self.monthly_limit
-            }
-            return False, f"Monthly limit of {self.monthly_limit} messages exceeded. Limit resets next month.", usage_info
+        upsert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+        stmt = upsert(_usage_table).values(
+            user_id=user_id,
+            date=now,
+            daily_message_count=1,
+            monthly_message_count=1,
+            last_reset_date=now,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.user_id],
+            set_={
+                "daily_message_count": daily + 1,
+                "monthly_message_count": monthly + 1,
+                "last_reset_date": case((new_day, now), else_=c.last_reset_date),
+            },
+            # Rejected requests leave the row untouched and return nothing
+            where=(daily < self.daily_limit) & (monthly < self.monthly_limit),
+        ).returning(*_usage_columns)
         
+        row = db.execute(stmt).first()
+        db.commit()
+        return tuple(row) if row is not None else None
+    
+    def _guarded_increment(self, db: Session, user_id: str) -> Optional[Tuple[int, int, datetime]]:
+        """
+        Portable fallback for databases without ON CONFLICT or UPDATE ... RETURNING
+        (e.g. MySQL): apply any reset, count the message with a guarded UPDATE
+        and read the new values back in the same transaction.
+        Returns the new (daily, monthly, last_reset) values, or None if a limit was hit.
+        """
+        now = datetime.utcnow()
+        user_usage = self._get_or_create_user_usage(db, user_id, now)
+        
+        # Reset counts if needed; committed with the increment below
+        if self._reset_counts_if_needed(user_usage, now):
+            self._save_user_usage(db, user_id, user_usage)
+        
+        c = _usage_table.c
+        result = db.execute(
+            update(_usage_table)
+            .where(
+                c.user_id == user_id,
+                c.daily_message_count < self.daily_limit,
+                c.monthly_message_count < self.monthly_limit,
+            )
+            .values(
+                daily_message_count=c.daily_message_count + 1,
+                monthly_message_count=c.monthly_message_count + 1,
+            )
+        )
+        row = None
+        if result.rowcount:
+            row = db.execute(select(*_usage_columns).where(c.user_id == user_id)).one()
+        db.commit()
+        return tuple(row) if row is not None else None
+    
+    def _limit_result(self, is_allowed: bool, daily_used: int, monthly_used: int) -> Tuple[bool, str, dict]:
         usage_info = {
-            "daily_used": user_usage.daily_message_count,
+            "daily_used": daily_used,
             "daily_limit": self.daily_limit,
-            "monthly_used": user_usage.monthly_message_count,
+            "monthly_used": monthly_used,
             "monthly_limit": self.monthly_limit
         }
-        
-        return True, "Request allowed", usage_info
+        if is_allowed:
+            return True, "Request allowed", usage_info
+        if daily_used >= self.daily_limit:
+            return False, f"Daily limit of {self.daily_limit} messages exceeded. Try again tomorrow.", usage_info
+        return False, f"Monthly limit of {self.monthly_limit} messages exceeded. Limit resets next month.", usage_info
+    
+    def _reset_cached_if_needed(self, user_id: str, entry: _UsageEntry) -> None:
+        """Apply day/month rollover to a cached entry (caller holds the lock)"""
+        if self._reset_counts_if_needed(entry):
+            self._dirty.add(user_id)
     
-    def increment_usage(self, user_identifier: str, db: Session) -> None:
-        """Increment user's message count"""
+    def check_and_increment(self, user_identifier: str, db: Session) -> Tuple[bool, str, dict]:
+        """
+        Check rate limits and, if allowed, count the message. Cached users are
+        handled in memory; otherwise this is one atomic statement, so
+        concurrent requests cannot both pass the check on the last remaining
+        message.
+        Returns: (is_allowed, message, usage_info)
+        """
         user_id = self._get_user_hash(user_identifier)
-        user_usage = self._get_or_create_user_usage(db, user_id)
         
-        # Reset counts if needed
-        self._reset_daily_count_if_needed(user_usage)
-        self._reset_monthly_count_if_needed(user_usage)
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                entry.last_access = time.monotonic()
+                self._reset_cached_if_needed(user_id, entry)
+                is_allowed = (
+                    entry.daily_message_count < self.daily_limit
+                    and entry.monthly_message_count < self.monthly_limit
+                )
+                if is_allowed:
+                    entry.daily_message_count += 1
+                    entry.monthly_message_count += 1
+                    self._dirty.add(user_id)
+                return self._limit_result(is_allowed, entry.daily_message_count, entry.monthly_message_count)
+        
+        dialect = db.get_bind().dialect
+        # The upsert needs ON CONFLICT and RETURNING; insert_returning is off
+        # for SQLite builds older than 3.35
+        if dialect.name in ("sqlite", "postgresql") and dialect.insert_returning:
+            row = self._atomic_check_and_increment(db, user_id)
+        else:
+            row = self._guarded_increment(db, user_id)
+        
+        is_allowed = row is not None
+        if not is_allowed:
+            row = db.execute(select(*_usage_columns).where(_usage_table.c.user_id == user_id)).one()
+        entry = _UsageEntry(*row)
         
-        # Increment counts
-        user_usage.daily_message_count += 1
-        user_usage.monthly_message_count += 1
+        # A rejected upsert leaves the row untouched, so a due reset has not
+        # been applied yet (e.g. a new day for a user at the monthly limit);
+        # apply it before reporting which limit was hit
+        reset = not is_allowed and self._reset_counts_if_needed(entry)
+        
+        with self._lock:
+            if self._cache.setdefault(user_id, entry) is entry and reset:
+                self._dirty.add(user_id)
+        return self._limit_result(is_allowed, entry.daily_message_count, entry.monthly_message_count)
+    
+    def refund_usage(self, user_identifier: str, db: Session) -> None:
+        """Give back a message counted by check_and_increment when the request failed"""
+        user_id = self._get_user_hash(user_identifier)
         
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                if entry.daily_message_count > 0 and entry.monthly_message_count > 0:
+                    entry.daily_message_count -= 1
+                    entry.monthly_message_count -= 1
+                    self._dirty.add(user_id)
+                return
+        
+        c = _usage_table.c
+        db.execute(
+            update(_usage_table)
+            .where(
+                c.user_id == user_id,
+                c.daily_message_count > 0,
+                c.monthly_message_count > 0,
+            )
+            .values(
+                daily_message_count=c.daily_message_count - 1,
+                monthly_message_count=c.monthly_message_count - 1,
+            )
+        )
         db.commit()
     
+    def flush(self) -> None:
+        """Write dirty cached counters back in one batched UPDATE and drop idle entries"""
+        with self._lock:
+            rows = [
+                {
+                    "b_user_id": user_id,
+                    "b_daily": self._cache[user_id].daily_message_count,
+                    "b_monthly": self._cache[user_id].monthly_message_count,
+                    "b_last_reset": self._cache[user_id].last_reset_date,
+                }
+                for user_id in self._dirty
+            ]
+            flushed = set(self._dirty)
+            self._dirty.clear()
+            cutoff = time.monotonic() - USAGE_CACHE_TTL
+            for user_id in [u for u, e in self._cache.items() if e.last_access < cutoff and u not in flushed]:
+                del self._cache[user_id]
+        
+        if not rows:
+            return
+        try:
+            with SessionLocal() as db:
+                db.execute(
+                    update(_usage_table)
+                    .where(_usage_table.c.user_id == bindparam("b_user_id"))
+                    .values(
+                        daily_message_count=bindparam("b_daily"),
+                        monthly_message_count=bindparam("b_monthly"),
+                        last_reset_date=bindparam("b_last_reset"),
+                    ),
+                    rows,
+                )
+                db.commit()
+        except Exception:
+            # Keep the changes for the next attempt
+            with self._lock:
+                self._dirty.update(u for u in flushed if u in self._cache)
+            raise
+    
+    async def run_flusher(self, interval: float = USAGE_FLUSH_INTERVAL) -> None:
+        """Background task: periodically flush dirty counters off the event loop"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"Warning: failed to flush usage counters: {str(e)}")
+    
     def get_usage_stats(self, user_identifier: str, db: Session) -> dict:
         """Get user's current usage statistics"""
         user_id = self._get_user_hash(user_identifier)
-        user_usage = self._get_or_create_user_usage(db, user_id)
         
-        # Reset counts if needed
-        self._reset_daily_count_if_needed(user_usage)
-        self._reset_monthly_count_if_needed(user_usage)
+        with self._lock:
+            user_usage = self._cache.get(user_id)
+            if user_usage is not None:
+                self._reset_cached_if_needed(user_id, user_usage)
+        if user_usage is None:
+            now = datetime.utcnow()
+            user_usage = self._get_or_create_user_usage(db, user_id, now)
+            
+            # Reset counts if needed
+            self._reset_counts_if_needed(user_usage, now)
         
         return {
             "daily_used": user_usage.daily_message_count,
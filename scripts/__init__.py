@@ -1 +1,15 @@
-# Scripts package 
\ No newline at end of file
+# Scripts package
+import asyncio
+from typing import Awaitable, Callable
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+def run(main: Callable[[], Awaitable[None]]) -> None:
+    """Run a script's async entry point, on uvloop when it is installed"""
+    # uvloop ships with uvicorn[standard]; fall back to asyncio's loop without it
+    if uvloop is not None:
+        uvloop.install()
+    asyncio.run(main())
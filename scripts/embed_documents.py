@@ -7,88 +7,162 @@ Usage: python scripts/embed_documents.py --input-dir ./documents --source-name "
 import os
 import sys
 import argparse
-import uuid
+import asyncio
+import hashlib
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterator, List, Tuple
 
 # Add the parent directory to the path so we can import app modules
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.services.openai_service import OpenAIService
-from app.services.pinecone_service import PineconeService
-from app.config import settings
+from app.services.pinecone_service import BatchChunks, PineconeService
+from app.config import get_settings
+from scripts import run
+
+# Inputs per embeddings request (the API accepts up to 2048) and requests in flight
+EMBED_BATCH_SIZE = 256
+EMBED_CONCURRENCY = 8
+
+# Characters read from a document at a time, and documents read at once
+READ_BLOCK_SIZE = 64 * 1024
+READ_CONCURRENCY = 8
 
 class DocumentEmbedder:
     def __init__(self):
         self.openai_service = OpenAIService()
         self.pinecone_service = PineconeService()
     
-    def read_text_file(self, file_path: str) -> str:
-        """Read text content from a file"""
+    def iter_text_blocks(self, file_path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator[str]:
+        """Yield the text content of a file in blocks"""
+        with open(file_path, 'r', encoding='utf-8') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    return
+                yield block
+    
+    def _read_and_chunk(self, file_path: str) -> List[str]:
+        """Read a document and split it into chunks (runs in a worker thread)"""
+        print(f"Processing: {file_path}")
+        
+        # Stream the document into the chunker instead of reading it whole
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
+            chunks = list(self.openai_service.chunk_text_stream(self.iter_text_blocks(file_path)))
         except Exception as e:
             print(f"Error reading file {file_path}: {str(e)}")
-            return ""
+            return []
+        if not chunks:
+            return []
+        
+        print(f"  Created {len(chunks)} chunks from {os.path.basename(file_path)}")
+        return chunks
     
-    async def process_document(self, file_path: str, source_name: str) -> List[Dict[str, Any]]:
-        """Process a single document and return chunks with embeddings"""
-        print(f"Processing: {file_path}")
+    async def _embed_batched(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in large batches, keeping a bounded number of requests in flight"""
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
         
-        # Read the document
-        content = self.read_text_file(file_path)
-        if not content:
-            return []
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self.openai_service.get_embeddings(batch)
+        
+        results = await asyncio.gather(*[
+            embed(texts[i:i + EMBED_BATCH_SIZE]) for i in range(0, len(texts), EMBED_BATCH_SIZE)
+        ])
+        return [embedding for batch in results for embedding in batch]
+    
+    def _add_document(self, documents: BatchChunks, file_path: str, doc_path: str, source_name: str, i: int, chunk: str, embedding: List[float]):
+        """Add one chunk to the batch prepared for Pinecone.
+
+        doc_path identifies the file within its corpus (relative to the input
+        directory), so IDs don't depend on how that directory was spelled.
+        """
+        # Deterministic, so re-ingesting a file overwrites its vectors instead of duplicating them
+        path_tag = hashlib.blake2b(f"{doc_path}|{i}".encode('utf-8'), digest_size=4).hexdigest()
+        doc_id = f"{source_name}_{os.path.basename(file_path)}_{i}_{path_tag}"
         
-        # Split into chunks
-        chunks = self.openai_service.chunk_text(content)
-        print(f"  Created {len(chunks)} chunks")
+        documents.append(doc_id, chunk, embedding, {
+            "source": source_name,
+            "chunk_index": i,
+            "file_path": file_path
+        })
+    
+    async def process_document(self, file_path: str, source_name: str) -> BatchChunks:
+        """Process a single document and return chunks with embeddings"""
+        documents = BatchChunks()
+        chunks = self._read_and_chunk(file_path)
+        if not chunks:
+            return documents
         
         # Generate embeddings for all chunks
-        embeddings = await self.openai_service.get_embeddings(chunks)
-        
-        # Prepare documents for Pinecone
-        documents = []
+        embeddings = await self._embed_batched(chunks)
+        doc_path = os.path.basename(file_path)
         for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            doc_id = f"{source_name}_{os.path.basename(file_path)}_{i}_{uuid.uuid4().hex[:8]}"
-            
-            documents.append({
-                "id": doc_id,
-                "text": chunk,
-                "embedding": embedding,
-                "source": source_name,
-                "chunk_index": i,
-                "file_path": file_path
-            })
-        
+            self._add_document(documents, file_path, doc_path, source_name, i, chunk, embedding)
         return documents
     
-    async def process_directory(self, input_dir: str, source_name: str) -> List[Dict[str, Any]]:
-        """Process all text files in a directory"""
-        all_documents = []
+    async def process_directory(self, input_dir: str, source_name: str) -> BatchChunks:
+        """Process all text files in a directory.
+
+        Chunks are embedded as soon as a full request's worth has been read,
+        and each result is stored quantized straight away, so only the files
+        and requests in flight are held in full.
+        """
+        all_documents = BatchChunks()
         input_path = Path(input_dir)
         
         if not input_path.exists():
             print(f"Error: Directory {input_dir} does not exist")
-            return []
+            return all_documents
         
-        # Find all text files
+        # Find all text files in a single walk of the tree
         text_extensions = {'.txt', '.md', '.rst', '.tex'}
-        text_files = []
+        file_paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(input_path)
+            for name in names
+            if os.path.splitext(name)[1] in text_extensions
+        ]
+        
+        print(f"Found {len(file_paths)} text files to process")
+        
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        requests = []
         
-        for ext in text_extensions:
-            text_files.extend(input_path.rglob(f"*{ext}"))
+        async def embed(batch: List[Tuple[str, str, int, str]]):
+            try:
+                embeddings = await self.openai_service.get_embeddings([chunk for *_, chunk in batch])
+            finally:
+                semaphore.release()
+            for (file_path, doc_path, i, chunk), embedding in zip(batch, embeddings):
+                self._add_document(all_documents, file_path, doc_path, source_name, i, chunk, embedding)
         
-        print(f"Found {len(text_files)} text files to process")
+        async def submit(batch: List[Tuple[str, str, int, str]]):
+            # Wait for a free slot, so reading never runs far ahead of embedding
+            await semaphore.acquire()
+            requests.append(asyncio.create_task(embed(batch)))
         
-        for file_path in text_files:
-            documents = await self.process_document(str(file_path), source_name)
-            all_documents.extend(documents)
+        pending = []
+        for start in range(0, len(file_paths), READ_CONCURRENCY):
+            # Read and chunk a few files at a time in worker threads
+            window = file_paths[start:start + READ_CONCURRENCY]
+            file_chunks = await asyncio.gather(*[
+                asyncio.to_thread(self._read_and_chunk, file_path) for file_path in window
+            ])
+            for file_path, chunks in zip(window, file_chunks):
+                doc_path = Path(file_path).relative_to(input_path).as_posix()
+                for i, chunk in enumerate(chunks):
+                    pending.append((file_path, doc_path, i, chunk))
+                    if len(pending) == EMBED_BATCH_SIZE:
+                        await submit(pending)
+                        pending = []
+        if pending:
+            await submit(pending)
         
+        await asyncio.gather(*requests)
         return all_documents
     
-    async def upload_documents(self, documents: List[Dict[str, Any]]) -> bool:
+    async def upload_documents(self, documents: BatchChunks) -> bool:
         """Upload documents to Pinecone"""
         if not documents:
             print("No documents to upload")
@@ -97,12 +171,7 @@ class DocumentEmbedder:
         print(f"Uploading {len(documents)} documents to Pinecone...")
         
         try:
-            # Upload in batches to avoid rate limits
-            batch_size = 100
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i:i + batch_size]
-                await self.pinecone_service.upsert_documents(batch)
-                print(f"  Uploaded batch {i//batch_size + 1}/{(len(documents) + batch_size - 1)//batch_size}")
+            await self.pinecone_service.upsert_batches(documents)
             
             print("Upload completed successfully!")
             return True
@@ -128,6 +197,7 @@ async def main():
     parser.add_argument("--dry-run", action="store_true", help="Process documents but don't upload to Pinecone")
     
     args = parser.parse_args()
+    settings = get_settings()
     
     # Validate environment variables
     if not settings.openai_api_key:
@@ -166,5 +236,4 @@ async def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main()) 
\ No newline at end of file
+    run(main) 
\ No newline at end of file
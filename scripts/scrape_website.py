@@ -7,72 +7,88 @@ Usage: python scripts/scrape_website.py --url "https://example.com" --source-nam
 import os
 import sys
 import argparse
-import requests
+import asyncio
+import httpx
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
+import hashlib
 import unicodedata
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Set
 
 # Add the parent directory to the path so we can import app modules
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.services.openai_service import OpenAIService
-from app.services.pinecone_service import PineconeService
-from app.config import settings
+from app.services.pinecone_service import BatchChunks, PineconeService
+from app.config import get_settings
+from scripts import run
+
+# Pages fetched concurrently while crawling
+SCRAPE_CONCURRENCY = 16
+
+# lxml parses much faster than the pure-Python parser; use it when installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Patterns used by clean_text, compiled once for every page
+_WS = re.compile(r'\s+')
+_ENT = re.compile(r'&[a-zA-Z]+;')
+
+# create_clean_id: ASCII punctuation is dropped; whitespace and non-ASCII separate words
+_ID_DROP = re.compile(r'[^a-zA-Z0-9\s\x80-\U0010ffff]')
+_ID_SEP = re.compile(r'(?:\s|[^\x00-\x7f])+')
+
+# Language names that mark a translated page in titles and URL paths
+NON_ENGLISH_LANGUAGES = [
+    'albanian', 'amharic', 'arabic', 'bengali', 'bosnian',
+    'chinese', 'dutch', 'finnish', 'french', 'german',
+    'hindi', 'indonesian', 'malay', 'persian', 'oromo',
+    'russian', 'swedish', 'somali', 'tamil', 'telugu',
+    'thai', 'turkish', 'urdu', 'bangla', 'bahasa',
+    'suomi', 'svenska', 'shqip', 'amargna', 'soomaali',
+    'farsi', 'bosanski'
+]
+
+# One alternation each, so a title or URL is scanned once instead of once per language
+_NON_ENGLISH_TITLE = re.compile('|'.join(NON_ENGLISH_LANGUAGES))
+_NON_ENGLISH_PATH = re.compile('/(?:' + '|'.join(NON_ENGLISH_LANGUAGES) + ')/')
 
 class WebsiteScraper:
     def __init__(self):
         self.openai_service = OpenAIService()
         self.pinecone_service = PineconeService()
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        }
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content"""
         if not text:
             return ""
         
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text.strip())
-        
-        # Remove common HTML artifacts
-        text = re.sub(r'&[a-zA-Z]+;', '', text)
-        
-        # Remove script and style content
-        text = re.sub(r'<script.*?</script>', '', text, flags=re.DOTALL)
-        text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)
-        
-        return text
+        # Remove common HTML artifacts, then collapse whitespace. Script and
+        # style elements are already dropped by extract_text_from_html.
+        return _WS.sub(' ', _ENT.sub('', text)).strip()
     
     def create_clean_id(self, text: str, max_length: int = 50) -> str:
         """Create a clean ASCII ID from text"""
-        # Normalize unicode characters
+        # Normalize unicode characters so accents split off their base letters
         text = unicodedata.normalize('NFKD', text)
         
-        # Convert to ASCII, replacing non-ASCII with spaces
-        text = ''.join(c if ord(c) < 128 else ' ' for c in text)
-        
-        # Remove special characters and extra spaces
-        text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
-        text = re.sub(r'\s+', '_', text.strip())
+        # Remove special characters, then join words with underscores
+        text = _ID_SEP.sub('_', _ID_DROP.sub('', text)).strip('_')
         
-        # Limit length
-        if len(text) > max_length:
-            text = text[:max_length]
-        
-        # Remove trailing underscores
-        text = text.rstrip('_')
-        
-        return text.lower()
+        # Limit length and remove trailing underscores
+        return text[:max_length].rstrip('_').lower()
     
-    def extract_text_from_html(self, html: str) -> str:
-        """Extract clean text from HTML content"""
-        soup = BeautifulSoup(html, 'html.parser')
-        
+    def extract_text_from_html(self, soup: BeautifulSoup) -> str:
+        """Extract clean text from an already-parsed page"""
         # Remove script and style elements
         for script in soup(["script", "style"]):
             script.decompose()
@@ -85,31 +101,23 @@ class WebsiteScraper:
         
         return text
     
-    def scrape_webpage(self, url: str) -> Dict[str, Any]:
-        """Scrape a single webpage"""
+    async def scrape_webpage(self, client: httpx.AsyncClient, url: str) -> Dict[str, Any]:
+        """Scrape a single webpage; successful results also carry the parsed page"""
         try:
             print(f"Scraping: {url}")
-            response = self.session.get(url, timeout=10)
+            response = await client.get(url)
             response.raise_for_status()
             
-            # Extract text content
-            text_content = self.extract_text_from_html(response.text)
+            # Parse once; text, title and links all come from the same tree
+            soup = BeautifulSoup(response.text, HTML_PARSER)
             
             # Get page title
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title = soup.find('title')
+            title = soup.title
             page_title = title.get_text().strip() if title else "Untitled"
             
             # Skip pages that appear to be non-English
-            if any(lang in page_title.lower() for lang in [
-                'albanian', 'amharic', 'arabic', 'bengali', 'bosnian',
-                'chinese', 'dutch', 'finnish', 'french', 'german',
-                'hindi', 'indonesian', 'malay', 'persian', 'oromo',
-                'russian', 'swedish', 'somali', 'tamil', 'telugu',
-                'thai', 'turkish', 'urdu', 'bangla', 'bahasa',
-                'suomi', 'svenska', 'shqip', 'amargna', 'soomaali',
-                'farsi', 'bosanski'
-            ]) and 'allah' not in page_title.lower():
+            lower_title = page_title.lower()
+            if _NON_ENGLISH_TITLE.search(lower_title) and 'allah' not in lower_title:
                 print(f"Skipping non-English page: {page_title}")
                 return {
                     "url": url,
@@ -118,11 +126,16 @@ class WebsiteScraper:
                     "status": "skipped"
                 }
             
+            # Extract text content only for pages that are kept
+            text_content = self.extract_text_from_html(soup)
+            
             return {
                 "url": url,
                 "title": page_title,
                 "content": text_content,
-                "status": "success"
+                "status": "success",
+                # Links are read from this tree, so the page is fetched and parsed once
+                "soup": soup
             }
             
         except Exception as e:
@@ -135,67 +148,66 @@ class WebsiteScraper:
                 "error": str(e)
             }
     
-    def find_links(self, html: str, base_url: str) -> List[str]:
-        """Find all links on a webpage"""
-        soup = BeautifulSoup(html, 'html.parser')
-        links = []
+    def find_links(self, soup: BeautifulSoup, base_url: str, seen: Optional[Set[str]] = None) -> Iterator[str]:
+        """Yield links on an already-parsed webpage that are not in ``seen`` yet, adding them to it"""
+        if seen is None:
+            seen = set()
+        base_netloc = urlparse(base_url).netloc
         
         for link in soup.find_all('a', href=True):
             href = link['href']
             full_url = urljoin(base_url, href)
+            if full_url in seen:
+                continue
             
             # Only include links to the same domain
-            if urlparse(full_url).netloc == urlparse(base_url).netloc:
+            if urlparse(full_url).netloc == base_netloc:
                 # Filter out non-English language pages
-                if not any(lang in full_url.lower() for lang in [
-                    '/albanian/', '/amharic/', '/arabic/', '/bengali/', '/bosnian/',
-                    '/chinese/', '/dutch/', '/finnish/', '/french/', '/german/',
-                    '/hindi/', '/indonesian/', '/malay/', '/persian/', '/oromo/',
-                    '/russian/', '/swedish/', '/somali/', '/tamil/', '/telugu/',
-                    '/thai/', '/turkish/', '/urdu/', '/bangla/', '/bahasa/',
-                    '/suomi/', '/svenska/', '/shqip/', '/amargna/', '/soomaali/',
-                    '/farsi/', '/telugu/', '/thai/', '/bosanski/', '/french/',
-                    '/russian/', '/bangla/', '/bahasa/', '/chinese/'
-                ]):
-                    links.append(full_url)
-        
-        return list(set(links))  # Remove duplicates
+                if not _NON_ENGLISH_PATH.search(full_url.lower()):
+                    seen.add(full_url)
+                    yield full_url
     
-    def scrape_website(self, base_url: str, max_pages: int = 10) -> List[Dict[str, Any]]:
-        """Scrape multiple pages from a website"""
+    async def scrape_website(self, base_url: str, max_pages: int = 10) -> List[Dict[str, Any]]:
+        """Scrape multiple pages from a website, fetching several pages at a time"""
         scraped_pages = []
-        visited_urls = set()
-        urls_to_visit = [base_url]
+        # Every URL ever queued, so each page is fetched at most once
+        seen = {base_url}
+        urls_to_visit = deque([base_url])
+        pending = set()
         
-        while urls_to_visit and len(scraped_pages) < max_pages:
-            current_url = urls_to_visit.pop(0)
-            
-            if current_url in visited_urls:
-                continue
-            
-            visited_urls.add(current_url)
-            
-            # Scrape the current page
-            page_data = self.scrape_webpage(current_url)
-            if page_data["status"] == "success" and page_data["content"]:
-                scraped_pages.append(page_data)
+        async with httpx.AsyncClient(headers=self.headers, timeout=10, follow_redirects=True) as client:
+            while len(scraped_pages) < max_pages:
+                # Keep the pipeline full without fetching more pages than could be kept
+                while (urls_to_visit and len(pending) < SCRAPE_CONCURRENCY
+                       and len(scraped_pages) + len(pending) < max_pages):
+                    current_url = urls_to_visit.popleft()
+                    pending.add(asyncio.create_task(self.scrape_webpage(client, current_url)))
+                
+                if not pending:
+                    break
                 
-                # Find more links if we haven't reached the limit
-                if len(scraped_pages) < max_pages:
-                    try:
-                        response = self.session.get(current_url, timeout=10)
-                        new_links = self.find_links(response.text, current_url)
-                        urls_to_visit.extend([link for link in new_links if link not in visited_urls])
-                    except:
-                        pass
+                # Handle pages as soon as they arrive so their links join the frontier early
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page_data = task.result()
+                    soup = page_data.pop("soup", None)
+                    if page_data["status"] == "success" and page_data["content"] and len(scraped_pages) < max_pages:
+                        scraped_pages.append(page_data)
+                        
+                        # Find more links if we haven't reached the limit
+                        if len(scraped_pages) < max_pages:
+                            urls_to_visit.extend(self.find_links(soup, page_data["url"], seen))
+                    
+                    print(f"Scraped {len(scraped_pages)}/{max_pages} pages")
             
-            print(f"Scraped {len(scraped_pages)}/{max_pages} pages")
+            for task in pending:
+                task.cancel()
         
         return scraped_pages
     
-    async def process_website_content(self, pages: List[Dict[str, Any]], source_name: str) -> List[Dict[str, Any]]:
+    async def process_website_content(self, pages: List[Dict[str, Any]], source_name: str) -> BatchChunks:
         """Process scraped website content and prepare for Pinecone"""
-        all_documents = []
+        all_documents = BatchChunks()
         
         for page in pages:
             if page["status"] != "success" or not page["content"]:
@@ -207,15 +219,14 @@ class WebsiteScraper:
             # Generate embeddings for chunks
             embeddings = await self.openai_service.get_embeddings(chunks)
             
-            # Prepare documents for Pinecone
+            # Prepare documents for Pinecone. IDs are derived from the URL so
+            # re-scraping a page overwrites its vectors instead of duplicating them.
+            url_tag = hashlib.blake2b(page['url'].encode('utf-8'), digest_size=4).hexdigest()
+            clean_title = self.create_clean_id(page['title'])
             for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                clean_title = self.create_clean_id(page['title'])
-                doc_id = f"{source_name}_{clean_title}_{i}_{hash(page['url']) % 10000}"
+                doc_id = f"{source_name}_{clean_title}_{i}_{url_tag}"
                 
-                all_documents.append({
-                    "id": doc_id,
-                    "text": chunk,
-                    "embedding": embedding,
+                all_documents.append(doc_id, chunk, embedding, {
                     "source": source_name,
                     "url": page["url"],
                     "title": page["title"],
@@ -224,7 +235,7 @@ class WebsiteScraper:
         
         return all_documents
     
-    async def upload_to_pinecone(self, documents: List[Dict[str, Any]]) -> bool:
+    async def upload_to_pinecone(self, documents: BatchChunks) -> bool:
         """Upload documents to Pinecone"""
         if not documents:
             print("No documents to upload")
@@ -233,12 +244,7 @@ class WebsiteScraper:
         print(f"Uploading {len(documents)} document chunks to Pinecone...")
         
         try:
-            # Upload in batches to avoid rate limits
-            batch_size = 100
-            for i in range(0, len(documents), batch_size):
-                batch = documents[i:i + batch_size]
-                await self.pinecone_service.upsert_documents(batch)
-                print(f"  Uploaded batch {i//batch_size + 1}/{(len(documents) + batch_size - 1)//batch_size}")
+            await self.pinecone_service.upsert_batches(documents)
             
             print("Upload completed successfully!")
             return True
@@ -254,6 +260,7 @@ async def main():
     parser.add_argument("--dry-run", action="store_true", help="Process content but don't upload to Pinecone")
     
     args = parser.parse_args()
+    settings = get_settings()
     
     # Validate environment variables
     if not settings.openai_api_key:
@@ -272,7 +279,7 @@ async def main():
     
     # Scrape website
     print(f"Scraping website: {args.url}")
-    pages = scraper.scrape_website(args.url, args.max_pages)
+    pages = await scraper.scrape_website(args.url, args.max_pages)
     
     if not pages:
         print("No content found to process")
@@ -302,5 +309,4 @@ async def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main()) 
\ No newline at end of file
+    run(main) 
\ No newline at end of file
@@ -7,8 +7,10 @@ import uvicorn
 import os
 from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Load environment variables from .env unless explicitly in production;
+# Render sets ENVIRONMENT=production and provides them directly
+if os.getenv("ENVIRONMENT") != "production":
+    load_dotenv()
 
 if __name__ == "__main__":
     # Get port from environment (Render sets this automatically)